@@ -9,6 +9,27 @@ import sys
 import time
 import requests
 import json
+import os
+import argparse
+import contextlib
+import io
+import re
+import ast
+import keyword
+import tokenize
+import mmap
+import struct
+import zlib
+import builtins
+import threading
+import bisect
+import itertools
+import multiprocessing
+import reprlib
+import types
+from array import array
+from collections import deque
+from multiprocessing.connection import wait
 from typing import Dict, Any, List, Tuple
 
 
@@ -25,22 +46,1383 @@ ORANGE = (255, 152, 0)
 PURPLE = (102, 16, 242)
 DARK_BLUE = (13, 110, 253)
 
+# Layout
+BASE_WIDTH = 1400
+BASE_HEIGHT = 900
+HIT_CELL_SIZE = 64
+CONTROL_BUTTONS = [
+    ('step', 'Step (Space)', BLUE),
+    ('run', 'Run (R)', GREEN),
+    ('pause', 'Pause (P)', ORANGE),
+    ('reset', 'Reset (Backspace)', RED),
+    ('back', 'Back to Edit (F5)', PURPLE),
+    ('heat', 'Heat (H)', DARK_BLUE),
+    ('continue', 'Continue (C)', RED),
+]
+
+# Syntax highlighting
+SYNTAX_COLORS = {
+    'keyword': PURPLE,
+    'builtin': DARK_BLUE,
+    'definition': BLUE,
+    'string': GREEN,
+    'number': ORANGE,
+    'comment': GRAY,
+    'text': BLACK,
+}
+_TRIPLE_QUOTE = re.compile(r"[rRbBuUfF]{0,2}(\"\"\"|''')")
+_STRING_TOKENS = {tokenize.STRING} | {
+    getattr(tokenize, name) for name in ('FSTRING_START', 'FSTRING_MIDDLE', 'FSTRING_END') if hasattr(tokenize, name)
+}
+
+# Tracing
+TRACE_FILENAME = "<codeflow>"
+TRACE_CHUNK_SIZE = 4096
+MAX_TRACE_EVENTS = 5_000_000
+MAX_TRACE_BYTES = 256 * 1024 * 1024
+# Approximate memory per recorded step (chunk columns), per frame record,
+# and per interned item or scope on top of its text and item slots
+TRACE_STEP_BYTES = 20
+TRACE_FRAME_BYTES = 20
+TRACE_ITEM_BYTES = 200
+TRACE_SCOPE_BYTES = 150
+
+# Session files
+SESSION_MAGIC = b"CFLOWSES"
+SESSION_VERSION = 3
+SESSION_FOOTER = struct.Struct("<QQ8s")
+# Scope table columns: array type code (None for the UTF-8 value blob) and
+# whether values are stored as deltas; each column is compressed in blocks
+SCOPE_COLUMNS = {
+    'item_name': ('i', False),
+    'item_type': ('i', False),
+    'item_line': ('i', False),
+    'item_value_offsets': ('q', True),
+    'item_values': (None, False),
+    'scope_offsets': ('q', True),
+    'scope_items': ('i', False),
+}
+SCOPE_BLOCK_SIZE = 16 * 1024
+DEFAULT_SESSION_PATH = "codeflow_session.cfs"
+
+# Grading
+GRADING_MAX_STEPS = 1_000_000
+GRADING_MAX_SECONDS = 30.0
+# Extra time before a worker that stopped responding is killed
+GRADING_KILL_GRACE = 5.0
+
+_short_repr = reprlib.Repr()
+_short_repr.maxstring = 50
+_short_repr.maxother = 50
+_MEMORY_ADDRESS = re.compile(r" at 0x[0-9a-fA-F]+")
+
+
+class _GradingRepr(reprlib.Repr):
+    """Short reprs without the memory address of default object reprs
+    
+    Functions, classes and plain objects print as '<function f at 0x...>',
+    so two runs of the same program would never compare equal.
+    """
+    
+    def repr_instance(self, x, level):
+        try:
+            text = _MEMORY_ADDRESS.sub("", builtins.repr(x))
+        except Exception:
+            return f"<{type(x).__name__} instance>"
+        if len(text) > self.maxother:
+            keep = max(0, (self.maxother - 3) // 2)
+            text = text[:keep] + "..." + text[len(text) - keep:]
+        return text
+
+
+_grading_repr = _GradingRepr()
+_grading_repr.maxstring = 50
+_grading_repr.maxother = 50
+
+
+class SyntaxHighlighter:
+    """Token-level highlighting with per-line token and surface caches
+    
+    Lines are tokenized on their own, carrying the open triple-quote
+    delimiter from line to line. Token spans and rendered surfaces are
+    cached by (line content, entry state), so only edited lines are
+    tokenized and rendered again, and entry states are only derived as
+    far down as lines are actually drawn.
+    """
+    
+    def __init__(self, font: pygame.font.Font, max_cached: int = 4096):
+        self.font = font
+        self.max_cached = max_cached
+        self._lines: List[str] = []
+        self._states: List[str] = [None]
+        self._token_cache: Dict[Tuple[str, str], Tuple[List[Tuple[int, int, str]], str]] = {}
+        self._surface_cache: Dict[Tuple[str, str], pygame.Surface] = {}
+        self._builtins = set(dir(builtins))
+    
+    def update(self, lines: List[str]):
+        """Invalidate entry states from the first changed line onward"""
+        if lines == self._lines:
+            return
+        
+        first = 0
+        common = min(len(lines), len(self._lines))
+        while first < common and lines[first] == self._lines[first]:
+            first += 1
+        
+        del self._states[first + 1:]
+        self._lines = list(lines)
+    
+    def render_line(self, index: int) -> pygame.Surface:
+        """Cached multi-color surface for one line of the last update"""
+        line = self._lines[index]
+        state = self._state_at(index)
+        key = (line, state)
+        surface = self._surface_cache.get(key)
+        if surface is None:
+            if len(self._surface_cache) >= self.max_cached:
+                self._surface_cache.clear()
+            surface = self._surface_cache[key] = self._render(line, state)
+        return surface
+    
+    def _state_at(self, index: int) -> str:
+        """Open triple-quote delimiter on entry to a line, derived lazily"""
+        states = self._states
+        while len(states) <= index:
+            _, exit_state = self._tokenize(self._lines[len(states) - 1], states[-1])
+            states.append(exit_state)
+        return states[index]
+    
+    def _render(self, line: str, state: str) -> pygame.Surface:
+        """Blit each token run of a line onto one transparent surface"""
+        spans, _ = self._tokenize(line, state)
+        surface = pygame.Surface(self.font.size(line), pygame.SRCALPHA)
+        
+        position = 0
+        segments = []
+        for start, end, kind in spans:
+            if start > position:
+                segments.append((position, start, 'text'))
+            segments.append((start, end, kind))
+            position = end
+        if position < len(line):
+            segments.append((position, len(line), 'text'))
+        
+        for start, end, kind in segments:
+            text = self.font.render(line[start:end], True, SYNTAX_COLORS[kind])
+            surface.blit(text, (self.font.size(line[:start])[0], 0))
+        return surface
+    
+    def _tokenize(self, line: str, state: str) -> Tuple[List[Tuple[int, int, str]], str]:
+        """(start, end, kind) spans and exit state for a line, cached"""
+        key = (line, state)
+        cached = self._token_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        spans = []
+        start = 0
+        exit_state = None
+        if state:
+            close = line.find(state)
+            if close < 0:
+                spans.append((0, len(line), 'string'))
+                start = len(line)
+                exit_state = state
+            else:
+                start = close + len(state)
+                spans.append((0, start, 'string'))
+        
+        if start < len(line):
+            last_end = start
+            previous = ""
+            try:
+                for token in tokenize.generate_tokens(io.StringIO(line[start:]).readline):
+                    if token.start[0] != 1:
+                        break
+                    end = start + token.end[1] if token.end[0] == 1 else len(line)
+                    kind = self._token_kind(token, previous)
+                    if kind:
+                        spans.append((start + token.start[1], end, kind))
+                    if token.string.strip():
+                        previous = token.string
+                    last_end = end
+            except (tokenize.TokenError, SyntaxError):
+                # An unterminated triple-quoted string carries over to the next line
+                match = _TRIPLE_QUOTE.search(line, last_end)
+                if match:
+                    spans.append((match.start(), len(line), 'string'))
+                    exit_state = match.group(1)
+        
+        if len(self._token_cache) >= self.max_cached * 4:
+            self._token_cache.clear()
+        result = self._token_cache[key] = (spans, exit_state)
+        return result
+    
+    def _token_kind(self, token: tokenize.TokenInfo, previous: str) -> str:
+        """Highlight class of a token, or None for plain text"""
+        if token.type == tokenize.COMMENT:
+            return 'comment'
+        if token.type in _STRING_TOKENS:
+            return 'string'
+        if token.type == tokenize.NUMBER:
+            return 'number'
+        if token.type == tokenize.NAME:
+            if keyword.iskeyword(token.string):
+                return 'keyword'
+            if previous in ('def', 'class'):
+                return 'definition'
+            if token.string in self._builtins:
+                return 'builtin'
+        return None
+
+
+class EditHistory:
+    """Undo/redo stacks of line-splice edits with coalesced typing runs
+    
+    An edit replaces lines[start:start + len(old)] with new. Only the
+    touched lines are stored, and unchanged strings are shared with the
+    buffer, so undo and redo cost O(edit size) rather than O(file size).
+    """
+    
+    def __init__(self, max_chars: int = 1_000_000, max_edits: int = 1000):
+        self.max_chars = max_chars
+        self.max_edits = max_edits
+        # Each edit: (kind, start, old lines, new lines, cursor before, cursor after)
+        self._undo: deque = deque()
+        self._redo: List[tuple] = []
+        self._chars = 0
+        self._sealed = True
+    
+    def record(self, kind: str, start: int, old: tuple, new: tuple, cursor_before: List[int], cursor_after: List[int]):
+        """Store an applied edit, merging it into a running typing run when possible"""
+        self._redo.clear()
+        cursor_before = tuple(cursor_before)
+        cursor_after = tuple(cursor_after)
+        
+        if self._undo and not self._sealed and kind in ('insert', 'delete'):
+            last_kind, last_start, last_old, last_new, last_before, last_after = self._undo[-1]
+            if (last_kind == kind and last_start == start and len(last_new) == len(old) == len(new) == 1
+                    and last_new[0] is old[0] and last_after == cursor_before):
+                self._discount(self._undo.pop())
+                old, cursor_before = last_old, last_before
+        
+        edit = (kind, start, old, new, cursor_before, cursor_after)
+        self._undo.append(edit)
+        self._chars += self._size(edit)
+        self._sealed = kind not in ('insert', 'delete')
+        
+        while self._undo and (self._chars > self.max_chars or len(self._undo) > self.max_edits):
+            self._discount(self._undo.popleft())
+    
+    def seal(self):
+        """End the current typing run so the next edit starts a new undo step"""
+        self._sealed = True
+    
+    def undo(self, lines: List[str]) -> List[int]:
+        """Revert the last edit in place; returns the cursor to restore"""
+        if not self._undo:
+            return None
+        edit = self._undo.pop()
+        self._discount(edit)
+        _, start, old, new, cursor_before, _ = edit
+        lines[start:start + len(new)] = old
+        self._redo.append(edit)
+        self._sealed = True
+        return list(cursor_before)
+    
+    def redo(self, lines: List[str]) -> List[int]:
+        """Re-apply the last undone edit in place; returns the cursor to restore"""
+        if not self._redo:
+            return None
+        edit = self._redo.pop()
+        _, start, old, new, _, cursor_after = edit
+        lines[start:start + len(old)] = new
+        self._undo.append(edit)
+        self._chars += self._size(edit)
+        self._sealed = True
+        return list(cursor_after)
+    
+    def clear(self):
+        """Forget all history"""
+        self._undo.clear()
+        self._redo.clear()
+        self._chars = 0
+        self._sealed = True
+    
+    @staticmethod
+    def _size(edit: tuple) -> int:
+        """Approximate stored size of an edit in characters"""
+        return sum(len(line) + 1 for line in edit[2]) + sum(len(line) + 1 for line in edit[3])
+    
+    def _discount(self, edit: tuple):
+        """Account for an edit leaving the undo stack"""
+        self._chars -= self._size(edit)
+
+
+class TraceAborted(BaseException):
+    """Raised inside the traced program to stop a recording"""
+
+
+class ExecutionRecorder:
+    """Runs user code under sys.settrace and records line events in chunks
+    
+    Each chunk holds four columns: line number, timestamp, frame id and
+    scope id. Frames and scopes are interned tables shared by all steps,
+    so deep recursion costs a few array slots per step instead of a copy
+    of every frame's locals.
+    """
+    
+    # Turns variable values into the text stored in scopes
+    value_repr = _short_repr
+    
+    def __init__(self, source: str, breakpoints: Dict[int, str] = None,
+                 max_events: int = MAX_TRACE_EVENTS, max_seconds: float = None,
+                 max_bytes: int = MAX_TRACE_BYTES):
+        self.source = source
+        self.breakpoints = dict(breakpoints or {})
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        # Estimated size of the recording so far
+        self.recorded_bytes = 0
+        self.max_seconds = max_seconds
+        self.chunks: List[Tuple[array, array, array, array]] = []
+        self.breakpoint_hits: List[int] = []
+        self.first_step: Dict[int, int] = {}
+        self.total_events = 0
+        self.start_time = 0.0
+        self.end_time = 0.0
+        self.error = ""
+        self.truncated = False
+        self.timed_out = False
+        self.done = False
+        self._stop = False
+        self._thread = None
+        
+        # Frame records, indexed by frame id
+        self.frame_names: List[str] = []
+        self.frame_name = array('i')
+        self.frame_parent = array('i')
+        self.frame_depth = array('i')
+        self.frame_call_line = array('i')
+        self.frame_caller_scope = array('i')
+        self._frame_name_ids: Dict[str, int] = {}
+        
+        # Interned scopes: tuples of (name, value, type, line set) items
+        self.scopes: List[tuple] = [()]
+        self._scope_ids: Dict[tuple, int] = {(): 0}
+        self._items: Dict[tuple, tuple] = {}
+    
+    def start(self):
+        """Start recording in a background thread"""
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Ask the traced program to stop at its next line"""
+        self._stop = True
+    
+    def line_at(self, step: int) -> int:
+        """Line number executed at a recorded step"""
+        return self.chunks[step // TRACE_CHUNK_SIZE][0][step % TRACE_CHUNK_SIZE]
+    
+    def frame_at(self, step: int) -> int:
+        """Frame id active at a recorded step"""
+        return self.chunks[step // TRACE_CHUNK_SIZE][2][step % TRACE_CHUNK_SIZE]
+    
+    def scope_at(self, step: int) -> int:
+        """Scope id of the active frame at a recorded step"""
+        return self.chunks[step // TRACE_CHUNK_SIZE][3][step % TRACE_CHUNK_SIZE]
+    
+    def call_stack(self, step: int) -> List[Tuple[int, int, int]]:
+        """(frame id, line, scope id) for every frame at a step, innermost first"""
+        frame_id = self.frame_at(step)
+        stack = [(frame_id, self.line_at(step), self.scope_at(step))]
+        while self.frame_parent[frame_id] >= 0:
+            parent = self.frame_parent[frame_id]
+            stack.append((parent, self.frame_call_line[frame_id], self.frame_caller_scope[frame_id]))
+            frame_id = parent
+        return stack
+    
+    def is_breakpoint_hit(self, step: int) -> bool:
+        """Whether a breakpoint fired at a recorded step"""
+        index = bisect.bisect_left(self.breakpoint_hits, step)
+        return index < len(self.breakpoint_hits) and self.breakpoint_hits[index] == step
+    
+    def _compile_breakpoints(self) -> Dict[int, Any]:
+        """Compile breakpoint conditions once; None means unconditional"""
+        compiled = {}
+        for line_number, condition in self.breakpoints.items():
+            if not condition.strip():
+                compiled[line_number] = None
+                continue
+            try:
+                compiled[line_number] = compile(condition, "<breakpoint>", "eval")
+            except SyntaxError as e:
+                self.error = f"Invalid breakpoint condition on line {line_number}: {e.msg}"
+        return compiled
+    
+    def run(self):
+        """Execute the source and record every line event in this thread"""
+        try:
+            code = compile(self.source, TRACE_FILENAME, "exec")
+        except SyntaxError as e:
+            self.error = f"SyntaxError on line {e.lineno}: {e.msg}"
+            self.done = True
+            return
+        
+        columns = self._new_columns()
+        clock = time.perf_counter
+        breakpoints = self._compile_breakpoints()
+        max_events = self.max_events
+        max_bytes = self.max_bytes
+        deadline = float('inf')
+        # Time spent inside these callbacks; timestamps are stored with it
+        # subtracted so each line is charged only for the program's own work
+        overhead = 0.0
+        # frame -> [frame id, variable items by name, last line, last scope id]
+        active = {}
+        
+        def trace_calls(frame, event, arg):
+            nonlocal overhead
+            if frame.f_code.co_filename != TRACE_FILENAME:
+                return None
+            entered = clock()
+            caller = frame.f_back
+            while caller is not None and caller not in active:
+                caller = caller.f_back
+            active[frame] = [self._new_frame(frame, active.get(caller)), {}, frame.f_code.co_firstlineno, 0]
+            overhead += clock() - entered
+            return trace_lines
+        
+        def trace_lines(frame, event, arg):
+            nonlocal columns, overhead
+            if event == 'line':
+                lines, times, frame_ids, scope_ids = columns
+                now = clock()
+                if (self._stop or self.total_events + len(lines) >= max_events or now > deadline
+                        or self.recorded_bytes >= max_bytes):
+                    raise TraceAborted()
+                line_number = frame.f_lineno
+                if line_number in breakpoints:
+                    self._check_breakpoint(frame, breakpoints[line_number], self.total_events + len(lines))
+                state = active[frame]
+                lines.append(line_number)
+                times.append(now - overhead)
+                frame_ids.append(state[0])
+                scope_ids.append(self._capture_scope(frame, state))
+                state[2] = line_number
+                if len(lines) >= TRACE_CHUNK_SIZE:
+                    self._flush(columns)
+                    columns = self._new_columns()
+                overhead += clock() - now
+            elif event == 'return':
+                active.pop(frame, None)
+            return trace_lines
+        
+        self.start_time = clock()
+        if self.max_seconds is not None:
+            deadline = self.start_time + self.max_seconds
+        sys.settrace(trace_calls)
+        try:
+            exec(code, {'__name__': '__main__', '__builtins__': builtins})
+        except TraceAborted:
+            if self.total_events + len(columns[0]) >= max_events:
+                self.truncated = True
+                self.error = f"Trace stopped after {max_events} steps"
+            elif self.recorded_bytes >= max_bytes:
+                self.truncated = True
+                steps = self.total_events + len(columns[0])
+                self.error = f"Trace stopped at {max_bytes // (1024 * 1024)} MB after {steps} steps"
+            elif clock() > deadline:
+                self.truncated = True
+                self.timed_out = True
+                self.error = f"Trace stopped after {self.max_seconds:g}s"
+        except SystemExit:
+            pass
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+        finally:
+            sys.settrace(None)
+            self.end_time = clock() - overhead
+            if columns[0]:
+                self._flush(columns)
+            self.done = True
+    
+    @staticmethod
+    def _new_columns() -> Tuple[array, array, array, array]:
+        """Empty line, time, frame and scope columns for one chunk"""
+        return array('i'), array('d'), array('i'), array('i')
+    
+    def _new_frame(self, frame, caller) -> int:
+        """Append a frame record and return its id"""
+        name = frame.f_code.co_name
+        name_id = self._frame_name_ids.get(name)
+        if name_id is None:
+            name_id = self._frame_name_ids[name] = len(self.frame_names)
+            self.frame_names.append(name)
+        
+        frame_id = len(self.frame_parent)
+        self.recorded_bytes += TRACE_FRAME_BYTES
+        self.frame_name.append(name_id)
+        if caller is None:
+            self.frame_parent.append(-1)
+            self.frame_depth.append(0)
+            self.frame_call_line.append(0)
+            self.frame_caller_scope.append(0)
+        else:
+            self.frame_parent.append(caller[0])
+            self.frame_depth.append(self.frame_depth[caller[0]] + 1)
+            self.frame_call_line.append(caller[2])
+            self.frame_caller_scope.append(caller[3])
+        return frame_id
+    
+    def _capture_scope(self, frame, state) -> int:
+        """Intern the frame's current variables and return the scope id"""
+        previous = state[1]
+        line_number = state[2]
+        items = {}
+        for name, value in frame.f_locals.items():
+            if name.startswith('__') or isinstance(value, types.ModuleType):
+                continue
+            text = self._value_text(value)
+            type_name = type(value).__name__
+            item = previous.get(name)
+            if item is None or item[1] != text or item[2] != type_name:
+                item = (name, text, type_name, line_number)
+                interned = self._items.setdefault(item, item)
+                if interned is item:
+                    self.recorded_bytes += TRACE_ITEM_BYTES + len(text)
+                item = interned
+            items[name] = item
+        state[1] = items
+        
+        scope = tuple(items.values())
+        scope_id = self._scope_ids.get(scope)
+        if scope_id is None:
+            scope_id = self._scope_ids[scope] = len(self.scopes)
+            self.scopes.append(scope)
+            self.recorded_bytes += TRACE_SCOPE_BYTES + 8 * len(scope)
+        state[3] = scope_id
+        return scope_id
+    
+    def _value_text(self, value) -> str:
+        """Short text for a value; a failing repr must not leak into the traced program"""
+        try:
+            return self.value_repr.repr(value)
+        except Exception:
+            if isinstance(value, int):
+                # e.g. ints above sys.get_int_max_str_digits()
+                return f"<int with ~{int(value.bit_length() * 0.30103) + 1} digits>"
+            return f"<unrepresentable {type(value).__name__}>"
+    
+    def _check_breakpoint(self, frame, condition, step: int):
+        """Record a breakpoint hit if its condition holds in the frame"""
+        if condition is not None:
+            try:
+                if not eval(condition, frame.f_globals, frame.f_locals):
+                    return
+            except Exception:
+                return
+        self.breakpoint_hits.append(step)
+    
+    def _flush(self, columns: Tuple[array, array, array, array]):
+        """Publish a finished chunk to readers"""
+        lines = columns[0]
+        for line_number in set(lines).difference(self.first_step):
+            self.first_step[line_number] = self.total_events + lines.index(line_number)
+        self.chunks.append(columns)
+        self.total_events += len(columns[0])
+        self.recorded_bytes += TRACE_STEP_BYTES * len(columns[0])
+
+
+class LineStats:
+    """Per-line hit counts, cumulative time and loop iterations from a trace"""
+    
+    def __init__(self, source: str):
+        self.hits: Dict[int, int] = {}
+        self.cumulative_time: Dict[int, float] = {}
+        self.loop_iterations: Dict[int, int] = {}
+        self.loops, self.one_line_whiles = self._find_loops(source)
+        self.max_hits = 0
+        self.max_time = 0.0
+        self._last_line = 0
+        self._last_time = 0.0
+        # frame id -> loop header that frame executed last
+        self._at_header: Dict[int, int] = {}
+    
+    @staticmethod
+    def _find_loops(source: str) -> Tuple[Dict[int, int], set]:
+        """Map each loop header line to the last line of its body; also list one-line while loops"""
+        try:
+            tree = ast.parse(source)
+        except SyntaxError:
+            return {}, set()
+        loops = {}
+        one_line_whiles = set()
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.For, ast.AsyncFor, ast.While)):
+                loops[node.lineno] = node.body[-1].end_lineno
+                if isinstance(node, ast.While) and loops[node.lineno] == node.lineno:
+                    one_line_whiles.add(node.lineno)
+        return loops, one_line_whiles
+    
+    def consume(self, lines: array, times: array, frame_ids: array):
+        """Fold one chunk of line events into the running totals"""
+        hits = self.hits
+        cumulative_time = self.cumulative_time
+        loops = self.loops
+        one_line_whiles = self.one_line_whiles
+        at_header = self._at_header
+        last_line = self._last_line
+        last_time = self._last_time
+        
+        for line, timestamp, frame_id in zip(lines, times, frame_ids):
+            hits[line] = hits.get(line, 0) + 1
+            if last_line:
+                cumulative_time[last_line] = cumulative_time.get(last_line, 0.0) + timestamp - last_time
+            
+            # Iterations are header-to-body moves within one frame, so code the
+            # header calls (generators, condition functions) runs in between
+            header = at_header.pop(frame_id, None)
+            if header is not None:
+                body_end = loops[header]
+                # A one-line for loop re-enters its header once per item and once more
+                # when the iterator runs out, so each re-entry is one iteration
+                if header < line <= body_end or (line == header == body_end and header not in one_line_whiles):
+                    self.loop_iterations[header] = self.loop_iterations.get(header, 0) + 1
+            if line in one_line_whiles:
+                # A one-line while tests its condition again at the bottom without a
+                # new line event, so every header event is one pass through the body
+                self.loop_iterations[line] = self.loop_iterations.get(line, 0) + 1
+            elif line in loops:
+                at_header[frame_id] = line
+            last_line = line
+            last_time = timestamp
+        
+        self._last_line = last_line
+        self._last_time = last_time
+        self.max_hits = max(hits.values(), default=0)
+        self.max_time = max(cumulative_time.values(), default=0.0)
+    
+    def finish(self, end_time: float):
+        """Charge the time after the final line event to that line"""
+        if self._last_line:
+            self.cumulative_time[self._last_line] = (
+                self.cumulative_time.get(self._last_line, 0.0) + max(0.0, end_time - self._last_time)
+            )
+            self.max_time = max(self.cumulative_time.values())
+            self._last_line = 0
+
+
+class MappedChunks:
+    """Read-only chunk sequence decompressed lazily from a memory-mapped session"""
+    
+    def __init__(self, data: mmap.mmap, index: List[list], swap: bool):
+        self._data = data
+        self._index = index
+        self._swap = swap
+        self._cache: Dict[int, Tuple[array, array, array, array]] = {}
+    
+    def __len__(self) -> int:
+        return len(self._index)
+    
+    def __getitem__(self, position: int) -> Tuple[array, array, array, array]:
+        chunk = self._cache.get(position)
+        if chunk is None:
+            chunk = self._load(position)
+            if len(self._cache) >= 16:
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[position] = chunk
+        return chunk
+    
+    def _load(self, position: int) -> Tuple[array, array, array, array]:
+        """Decompress one chunk and rebuild its timestamps"""
+        offset, length, count, timestamp = self._index[position]
+        raw = zlib.decompress(self._data[offset:offset + length])
+        lines, deltas, frame_ids, scope_ids = array('i'), array('q'), array('i'), array('i')
+        cursor = 0
+        for column in (lines, deltas, frame_ids, scope_ids):
+            size = column.itemsize * count
+            column.frombytes(raw[cursor:cursor + size])
+            cursor += size
+            if self._swap:
+                column.byteswap()
+        
+        # Timestamps are nanosecond deltas from the previous event
+        times = array('d')
+        ticks = 0
+        for delta in deltas:
+            ticks += delta
+            times.append(timestamp + ticks / 1e9)
+        return lines, times, frame_ids, scope_ids
+
+
+class MappedScopes:
+    """Read-only scope table decoded one scope at a time from a session map or other buffer
+    
+    Items are stored as columns (name id, type id, line, value offset) next
+    to one UTF-8 blob of values; scopes are runs of item ids. Every column
+    is split into fixed-size blocks compressed on their own, and a block is
+    only decompressed when a scope that needs it is asked for.
+    """
+    
+    def __init__(self, data: Any, columns: Dict[str, Dict[str, Any]], names: List[str],
+                 type_names: List[str], byteorder: str):
+        self._data = data
+        self._columns = columns
+        self._names = names
+        self._type_names = type_names
+        self._swap = byteorder != sys.byteorder
+        self._count = columns['scope_offsets']['size'] // 8 - 1
+        self._per_block = {name: SCOPE_BLOCK_SIZE // array(code).itemsize
+                           for name, (code, _) in SCOPE_COLUMNS.items() if code}
+        self._blocks: Dict[Tuple[str, int], Any] = {}
+        self._items: Dict[int, tuple] = {}
+        self._cache: Dict[int, tuple] = {}
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    def __getitem__(self, scope_id: int) -> tuple:
+        if not 0 <= scope_id < self._count:
+            raise IndexError(scope_id)
+        scope = self._cache.get(scope_id)
+        if scope is None:
+            start = self._value('scope_offsets', scope_id)
+            stop = self._value('scope_offsets', scope_id + 1)
+            scope = tuple(self._item(self._value('scope_items', index)) for index in range(start, stop))
+            if len(self._cache) >= 256:
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[scope_id] = scope
+        return scope
+    
+    def _item(self, item_id: int) -> tuple:
+        """Decode one (name, value, type, line) item; neighbouring scopes mostly share items"""
+        item = self._items.get(item_id)
+        if item is None:
+            start = self._value('item_value_offsets', item_id)
+            stop = self._value('item_value_offsets', item_id + 1)
+            value = self._bytes(start, stop).decode("utf-8")
+            item = (self._names[self._value('item_name', item_id)], value,
+                    self._type_names[self._value('item_type', item_id)], self._value('item_line', item_id))
+            if len(self._items) >= 1024:
+                self._items.pop(next(iter(self._items)))
+            self._items[item_id] = item
+        return item
+    
+    def _value(self, name: str, index: int) -> int:
+        """One element of a numeric column"""
+        position, offset = divmod(index, self._per_block[name])
+        block = self._blocks.get((name, position))
+        if block is None:
+            block = self._block(name, position)
+        return block[offset]
+    
+    def _bytes(self, start: int, stop: int) -> bytes:
+        """A byte range of the value blob, which may span blocks"""
+        parts = []
+        while start < stop:
+            block = self._block('item_values', start // SCOPE_BLOCK_SIZE)
+            offset = start % SCOPE_BLOCK_SIZE
+            part = block[offset:offset + stop - start]
+            parts.append(part)
+            start += len(part)
+        return b"".join(parts)
+    
+    def _block(self, name: str, position: int):
+        """Decompress one block of a column, keeping recently used blocks"""
+        key = (name, position)
+        block = self._blocks.get(key)
+        if block is None:
+            offset, length = self._columns[name]['blocks'][position]
+            raw = zlib.decompress(self._data[offset:offset + length])
+            code, delta = SCOPE_COLUMNS[name]
+            if code is None:
+                block = raw
+            else:
+                block = array(code)
+                block.frombytes(raw)
+                if self._swap:
+                    block.byteswap()
+                if delta:
+                    block = array(code, itertools.accumulate(block))
+            if len(self._blocks) >= 32:
+                self._blocks.pop(next(iter(self._blocks)))
+            self._blocks[key] = block
+        return block
+
+
+def _encode_scopes(scopes, write_block) -> Tuple[Dict[str, Dict[str, Any]], List[str], List[str]]:
+    """Write a scope table as compressed column blocks for MappedScopes
+    
+    write_block compresses and stores one block, returning its [offset, length].
+    Also returns the variable name and type name tables.
+    """
+    item_ids = {}
+    names, name_ids = [], {}
+    type_names, type_ids = [], {}
+    item_name, item_type, item_line = array('i'), array('i'), array('i')
+    item_value_offsets = array('q', [0])
+    item_values = bytearray()
+    scope_offsets = array('q', [0])
+    scope_items = array('i')
+    for position in range(len(scopes)):
+        for item in scopes[position]:
+            item_id = item_ids.get(item)
+            if item_id is None:
+                item_id = item_ids[item] = len(item_line)
+                name, value, type_name, line_number = item
+                if name not in name_ids:
+                    name_ids[name] = len(names)
+                    names.append(name)
+                if type_name not in type_ids:
+                    type_ids[type_name] = len(type_names)
+                    type_names.append(type_name)
+                item_name.append(name_ids[name])
+                item_type.append(type_ids[type_name])
+                item_line.append(line_number)
+                item_values += value.encode("utf-8")
+                item_value_offsets.append(len(item_values))
+            scope_items.append(item_id)
+        scope_offsets.append(len(scope_items))
+    
+    values = {
+        'item_name': item_name,
+        'item_type': item_type,
+        'item_line': item_line,
+        'item_value_offsets': item_value_offsets,
+        'item_values': item_values,
+        'scope_offsets': scope_offsets,
+        'scope_items': scope_items,
+    }
+    columns = {}
+    for name, column in values.items():
+        code, delta = SCOPE_COLUMNS[name]
+        per_block = SCOPE_BLOCK_SIZE if code is None else SCOPE_BLOCK_SIZE // column.itemsize
+        blocks = []
+        for start in range(0, len(column), per_block):
+            block = column[start:start + per_block]
+            if delta:
+                # Offsets grow steadily; differences within a block compress far better
+                block = array(code, [block[0]] + [b - a for a, b in zip(block, block[1:])])
+            blocks.append(write_block(bytes(block)))
+        size = len(column) if code is None else len(column) * column.itemsize
+        columns[name] = {'size': size, 'blocks': blocks}
+    return columns, names, type_names
+
+
+def save_session(path: str, recorder: ExecutionRecorder, statements: List[Dict[str, Any]], explanations: List[str]):
+    """Write a finished recording, its statement table and explanations to a session file"""
+    if not recorder.done:
+        raise ValueError("Recording is still running")
+    
+    def write_block(f, payload: bytes) -> List[int]:
+        block = zlib.compress(payload, 6)
+        offset = f.tell()
+        f.write(block)
+        return [offset, len(block)]
+    
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(SESSION_MAGIC)
+        
+        # Trace chunks: each column stored contiguously, times as deltas
+        chunk_index = []
+        for position in range(len(recorder.chunks)):
+            lines, times, frame_ids, scope_ids = recorder.chunks[position]
+            chunk_start = times[0] if times else recorder.start_time
+            deltas = array('q')
+            previous_ticks = 0
+            for timestamp in times:
+                ticks = round((timestamp - chunk_start) * 1e9)
+                deltas.append(ticks - previous_ticks)
+                previous_ticks = ticks
+            payload = lines.tobytes() + deltas.tobytes() + frame_ids.tobytes() + scope_ids.tobytes()
+            chunk_index.append(write_block(f, payload) + [len(lines), chunk_start])
+        
+        frame_blocks = {
+            name: write_block(f, getattr(recorder, name).tobytes())
+            for name in ('frame_name', 'frame_parent', 'frame_depth', 'frame_call_line', 'frame_caller_scope')
+        }
+        hits_block = write_block(f, array('i', recorder.breakpoint_hits).tobytes())
+        
+        # Scopes reference a shared table of variable items, stored in column
+        # blocks so a loaded session can decode single scopes on demand
+        scope_columns, item_names, item_types = _encode_scopes(recorder.scopes,
+                                                               lambda payload: write_block(f, payload))
+        
+        header = {
+            'version': SESSION_VERSION,
+            'byteorder': sys.byteorder,
+            'source': recorder.source,
+            'breakpoints': {str(line): condition for line, condition in recorder.breakpoints.items()},
+            'error': recorder.error,
+            'total_events': recorder.total_events,
+            'start_time': recorder.start_time,
+            'end_time': recorder.end_time,
+            'chunks': chunk_index,
+            'frames': frame_blocks,
+            'breakpoint_hits': hits_block,
+            'first_step': {str(line): step for line, step in recorder.first_step.items()},
+            'frame_names': recorder.frame_names,
+            'item_names': item_names,
+            'item_types': item_types,
+            'scopes': scope_columns,
+            'statements': [
+                {key: line[key] for key in ('line_number', 'content', 'indent', 'node_type')}
+                for line in statements
+            ],
+            'explanations': explanations,
+        }
+        header_offset, header_length = write_block(f, json.dumps(header).encode("utf-8"))
+        f.write(SESSION_FOOTER.pack(header_offset, header_length, SESSION_MAGIC))
+    os.replace(temp_path, path)
+
+
+def load_session(path: str) -> Tuple[ExecutionRecorder, List[Dict[str, Any]], List[str]]:
+    """Open a session file without re-executing; trace chunks are read on demand"""
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    if len(data) < len(SESSION_MAGIC) + SESSION_FOOTER.size or data[:len(SESSION_MAGIC)] != SESSION_MAGIC:
+        raise ValueError(f"{path} is not a CodeFlow session file")
+    header_offset, header_length, magic = SESSION_FOOTER.unpack(data[-SESSION_FOOTER.size:])
+    if magic != SESSION_MAGIC:
+        raise ValueError(f"{path} is truncated")
+    header = json.loads(zlib.decompress(data[header_offset:header_offset + header_length]))
+    if header['version'] != SESSION_VERSION:
+        raise ValueError(f"Unsupported session version {header['version']}")
+    swap = header['byteorder'] != sys.byteorder
+    
+    def read_block(block: List[int]) -> array:
+        offset, length = block
+        column = array('i', zlib.decompress(data[offset:offset + length]))
+        if swap:
+            column.byteswap()
+        return column
+    
+    breakpoints = {int(line): condition for line, condition in header['breakpoints'].items()}
+    recorder = ExecutionRecorder(header['source'], breakpoints)
+    recorder.chunks = MappedChunks(data, header['chunks'], swap)
+    recorder.total_events = header['total_events']
+    recorder.start_time = header['start_time']
+    recorder.end_time = header['end_time']
+    recorder.error = header['error']
+    recorder.breakpoint_hits = list(read_block(header['breakpoint_hits']))
+    recorder.first_step = {int(line): step for line, step in header['first_step'].items()}
+    recorder.frame_names = header['frame_names']
+    for name, block in header['frames'].items():
+        setattr(recorder, name, read_block(block))
+    
+    recorder.scopes = MappedScopes(data, header['scopes'], header['item_names'], header['item_types'],
+                                   header['byteorder'])
+    recorder.done = True
+    
+    statements = [dict(line, is_current=False, is_executed=False) for line in header['statements']]
+    return recorder, statements, header['explanations']
+
+
+def _flatten_column(recorder: ExecutionRecorder, column: int) -> array:
+    """One trace column across all chunks"""
+    values = array('i')
+    for position in range(len(recorder.chunks)):
+        values.extend(recorder.chunks[position][column])
+    return values
+
+
+class GradingRecorder(ExecutionRecorder):
+    """Traces a submission against a reference trace, stopping at the first difference
+    
+    Each line event is checked against the reference as it happens, and
+    nothing is kept afterwards: chunks are counted and dropped, and frames
+    and scopes are not interned. Memory stays flat however long the run.
+    """
+    
+    value_repr = _grading_repr
+    
+    def __init__(self, source: str, reference: Dict[str, Any]):
+        # One step past the reference is enough to tell that a run is too long;
+        # a reference cut off by the limits is only compared up to its cutoff
+        max_events = reference['steps'] if reference['truncated'] else reference['steps'] + 1
+        super().__init__(source, max_events=max_events, max_seconds=reference['max_seconds'])
+        self.reference = reference
+        # (kind, step, reference line, expected, actual) of the first difference
+        self.divergence = None
+        self._step = 0
+    
+    def _new_frame(self, frame, caller) -> int:
+        return 0
+    
+    def _capture_scope(self, frame, state) -> int:
+        step = self._step
+        self._step += 1
+        reference = self.reference
+        if step >= reference['steps']:
+            # Already longer than the reference; the step limit ends the run
+            return 0
+        
+        expected_line = reference['lines'][step]
+        if frame.f_lineno != expected_line:
+            self.divergence = ('line', step, expected_line, f"line {expected_line}", f"line {frame.f_lineno}")
+            raise TraceAborted()
+        
+        variables = frame.f_locals
+        for name, value, type_name, _ in reference['scopes'][reference['scope_ids'][step]]:
+            if name not in variables:
+                self.divergence = ('variable', step, expected_line, f"{name} = {value}", f"{name} undefined")
+                raise TraceAborted()
+            actual = variables[name]
+            text = self._value_text(actual)
+            if text != value or type(actual).__name__ != type_name:
+                self.divergence = ('variable', step, expected_line, f"{name} = {value}", f"{name} = {text}")
+                raise TraceAborted()
+        return 0
+    
+    def _flush(self, columns: Tuple[array, array, array, array]):
+        self.total_events += len(columns[0])
+
+
+# Reference trace shared by every task in a grading worker process
+_grading_reference = None
+
+
+def _init_grading_worker(reference: Dict[str, Any]):
+    """Worker setup: keep the reference trace and silence student input"""
+    global _grading_reference
+    _grading_reference = dict(reference, scopes=MappedScopes(*reference['scopes']))
+    sys.stdin = io.StringIO()
+
+
+def _grading_worker(connection, reference: Dict[str, Any]):
+    """Worker process loop: grade each path sent by the parent until it sends None"""
+    _init_grading_worker(reference)
+    while True:
+        path = connection.recv()
+        if path is None:
+            return
+        connection.send(grade_submission(path))
+
+
+def _grading_result(path: str, **fields) -> Dict[str, Any]:
+    """A result row, a match unless fields say otherwise"""
+    result = {'submission': path, 'status': 'match', 'kind': '', 'step': None, 'line': None,
+              'expected': '', 'actual': '', 'steps': 0, 'error': ''}
+    result.update(fields)
+    return result
+
+
+def grade_submission(path: str) -> Dict[str, Any]:
+    """Trace one submission and find where it first diverges from the reference"""
+    reference = _grading_reference
+    result = _grading_result(path)
+    try:
+        with open(path, encoding="utf-8") as f:
+            source = f.read()
+    except (OSError, UnicodeDecodeError) as e:
+        result.update(status='failed', error=str(e))
+        return result
+    
+    recorder = GradingRecorder(source, reference)
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        recorder.run()
+    result['steps'] = recorder.total_events
+    result['error'] = "" if recorder.truncated else recorder.error
+    
+    if recorder.divergence:
+        kind, step, line, expected, actual = recorder.divergence
+        result.update(status='diverged', kind=kind, step=step, line=line, expected=expected, actual=actual)
+        return result
+    
+    steps = recorder.total_events
+    reference_steps = reference['steps']
+    line = reference['lines'][steps] if steps < reference_steps else None
+    if recorder.timed_out:
+        # Ran out of time before the reference's last step; no verdict possible
+        result.update(status='failed', error=recorder.error)
+    elif result['error'] and result['error'] != reference['error']:
+        result.update(status='diverged', kind='exception', step=min(steps, reference_steps), line=line,
+                      expected=reference['error'] or "no exception", actual=result['error'])
+    elif steps != reference_steps:
+        result.update(status='diverged', kind='length', step=min(steps, reference_steps), line=line,
+                      expected=f"{reference_steps} steps",
+                      actual="more steps" if steps > reference_steps else f"{steps} steps")
+    return result
+
+
+def grade_submissions(reference_path: str, submission_paths: List[str], workers: int = None,
+                      max_steps: int = GRADING_MAX_STEPS,
+                      max_seconds: float = GRADING_MAX_SECONDS) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Trace submissions in parallel and diff each execution against the reference"""
+    with open(reference_path, encoding="utf-8") as f:
+        reference_source = f.read()
+    recorder = ExecutionRecorder(reference_source, max_events=max_steps, max_seconds=max_seconds)
+    recorder.value_repr = _grading_repr
+    stdin = sys.stdin
+    sys.stdin = io.StringIO()
+    try:
+        with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+            recorder.run()
+    finally:
+        sys.stdin = stdin
+    if recorder.timed_out:
+        # A time cutoff lands on a different step every run, so there is nothing to compare up to
+        raise ValueError(f"Reference solution did not finish within {max_seconds:g}s; "
+                         f"lower the step limit so it is cut off by steps instead")
+    
+    # Workers get the scope table as one buffer of compressed blocks and decode scopes as they go
+    scope_buffer = bytearray()
+    
+    def write_block(payload: bytes) -> List[int]:
+        block = zlib.compress(payload, 6)
+        scope_buffer.extend(block)
+        return [len(scope_buffer) - len(block), len(block)]
+    
+    scope_columns, item_names, item_types = _encode_scopes(recorder.scopes, write_block)
+    
+    reference = {
+        'path': reference_path,
+        'source_lines': reference_source.split("\n"),
+        'lines': _flatten_column(recorder, 0),
+        'scope_ids': _flatten_column(recorder, 3),
+        'scopes': (bytes(scope_buffer), scope_columns, item_names, item_types, sys.byteorder),
+        'steps': recorder.total_events,
+        'error': "" if recorder.truncated else recorder.error,
+        'truncated': recorder.truncated,
+        'max_seconds': max_seconds,
+    }
+    del recorder
+    
+    workers = min(workers or os.cpu_count() or 1, len(submission_paths))
+    return reference, _run_grading_workers(reference, submission_paths, workers, max_seconds + GRADING_KILL_GRACE)
+
+
+def _run_grading_workers(reference: Dict[str, Any], paths: List[str], workers: int,
+                         time_limit: float) -> List[Dict[str, Any]]:
+    """Hand paths to worker processes one at a time under a watchdog
+    
+    A submission can block in C code where the tracer never runs, or kill
+    its process outright (os._exit, the OOM killer). Such a worker is
+    killed or reaped, its submission is reported as failed, and a fresh
+    worker takes its place, so one bad submission never costs the batch.
+    """
+    results: List[Dict[str, Any]] = [None] * len(paths)
+    pending = deque(range(len(paths)))
+    # connection -> [process, index of the submission being graded, start time]
+    busy: Dict[Any, list] = {}
+    
+    def start_worker():
+        connection, child_connection = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_grading_worker, args=(child_connection, reference), daemon=True)
+        process.start()
+        child_connection.close()
+        busy[connection] = [process, None, 0.0]
+        assign(connection)
+    
+    def retire(connection) -> Tuple[Any, int]:
+        process, index, _ = busy.pop(connection)
+        if process.is_alive():
+            process.kill()
+        process.join()
+        connection.close()
+        return process, index
+    
+    def assign(connection):
+        state = busy[connection]
+        if not pending:
+            connection.send(None)
+            retire(connection)
+            return
+        state[1] = pending.popleft()
+        state[2] = time.monotonic()
+        try:
+            connection.send(paths[state[1]])
+        except OSError:
+            # Worker died between submissions; hand the path to a fresh one
+            pending.appendleft(retire(connection)[1])
+            start_worker()
+    
+    def fail(connection, error: str = None):
+        process, index = retire(connection)
+        error = error or f"Worker exited with code {process.exitcode}"
+        results[index] = _grading_result(paths[index], status='failed', error=error)
+        if pending:
+            start_worker()
+    
+    def collect(connection):
+        # Take a finished result, or fail the submission whose worker died
+        state = busy[connection]
+        try:
+            if connection.poll():
+                results[state[1]] = connection.recv()
+                assign(connection)
+                return
+        except (EOFError, OSError):
+            pass
+        if not state[0].is_alive():
+            fail(connection)
+    
+    try:
+        for _ in range(workers):
+            start_worker()
+        while busy:
+            sentinels = {state[0].sentinel: connection for connection, state in busy.items()}
+            for ready in wait(list(busy) + list(sentinels), timeout=1.0):
+                connection = sentinels.get(ready, ready)
+                if connection in busy:
+                    collect(connection)
+            now = time.monotonic()
+            for connection, (_, index, started) in list(busy.items()):
+                if now - started > time_limit:
+                    fail(connection, f"Killed after {time_limit:g}s without finishing")
+    finally:
+        for process, _, _ in busy.values():
+            process.kill()
+    return results
+
+
+def format_grading_report(reference: Dict[str, Any], results: List[Dict[str, Any]], elapsed: float) -> str:
+    """Plain-text summary of a grading run"""
+    counts = {status: sum(1 for result in results if result['status'] == status)
+              for status in ('match', 'diverged', 'failed')}
+    report = [
+        f"Reference: {reference['path']} ({reference['steps']} steps"
+        + (", truncated; submissions compared up to this step" if reference['truncated'] else "") + ")",
+        f"Graded {len(results)} submissions in {elapsed:.1f}s: "
+        f"{counts['match']} match, {counts['diverged']} diverged, {counts['failed']} failed",
+        "",
+        f"{'Submission':<40} {'Result':<10} {'Step':>8} {'Line':>5}  Detail",
+    ]
+    
+    for result in results:
+        step = "" if result['step'] is None else str(result['step'])
+        line = "" if result['line'] is None else str(result['line'])
+        if result['status'] == 'diverged':
+            detail = f"{result['kind']}: expected {result['expected']}, got {result['actual']}"
+        else:
+            detail = result['error']
+        report.append(f"{result['submission']:<40} {result['status']:<10} {step:>8} {line:>5}  {detail}")
+    
+    # Lines where most submissions go wrong
+    divergence_lines = {}
+    for result in results:
+        if result['status'] == 'diverged' and result['line']:
+            divergence_lines[result['line']] = divergence_lines.get(result['line'], 0) + 1
+    if divergence_lines:
+        report += ["", "Most common divergence lines:"]
+        for line, count in sorted(divergence_lines.items(), key=lambda item: -item[1])[:10]:
+            content = reference['source_lines'][line - 1].strip()
+            report.append(f"  line {line} ({content}): {count} submissions")
+    return "\n".join(report)
+
+
+class Layout:
+    """Panel, button and text-row geometry for one window size
+    
+    All rects are derived once per resize from the window size and a UI
+    scale (window size relative to the 1400x900 design; the HiDPI factor
+    only sets the initial window size). Hit targets are bucketed into a
+    coarse grid so a click only tests the few rects sharing its cell.
+    """
+    
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.scale = scale = max(0.6, min(width / BASE_WIDTH, height / BASE_HEIGHT))
+        
+        self.margin = margin = self.px(20)
+        self.pad = self.px(10)
+        self.row_height = self.px(25)
+        self.stack_row_height = self.px(22)
+        self.explanation_row_height = self.px(20)
+        self.gutter = self.px(60)
+        self.font_sizes = {name: max(8, round(size * scale)) for name, size in
+                           (('small', 20), ('medium', 24), ('large', 32), ('code', 18))}
+        
+        # Input mode
+        self.title_pos = (margin, margin)
+        self.status_message_y = self.px(62)
+        self.start_button = pygame.Rect(width - self.px(200), margin, self.px(180), self.px(40))
+        self.instructions_top = self.px(80)
+        self.instruction_step = self.px(30)
+        self.editor = pygame.Rect(margin, self.px(250), width - 2 * margin,
+                                  max(height - self.px(400), 2 * self.row_height))
+        self.editor_rows_top = self.editor.y + self.px(20)
+        
+        # Visualize mode, laid out from the bottom up
+        self.timeline = pygame.Rect(margin, height - self.px(40), width - 2 * margin, self.px(12))
+        self.status_y = height - self.px(80)
+        button_y = height - self.px(125)
+        self.buttons = {
+            name: pygame.Rect(self.px(50) + i * self.px(110), button_y, self.px(100), self.px(40))
+            for i, (name, _, _) in enumerate(CONTROL_BUTTONS)
+        }
+        self.explanations_panel = pygame.Rect(margin, button_y - self.px(180), width - 2 * margin, self.px(170))
+        top = self.px(80)
+        main_height = max(self.explanations_panel.y - self.px(20) - top, 4 * self.row_height)
+        self.code_panel = pygame.Rect(margin, top, round((width - 3 * margin) * 0.52), main_height)
+        right_x = self.code_panel.right + margin
+        self.variables_panel = pygame.Rect(right_x, top, width - margin - right_x, round(main_height * 0.62))
+        self.call_stack_panel = pygame.Rect(right_x, self.variables_panel.bottom + self.pad,
+                                            self.variables_panel.width,
+                                            main_height - self.variables_panel.height - self.pad)
+        self.panel_rows_top = self.px(50)
+        self.call_stack_rows_top = self.call_stack_panel.y + self.px(30)
+        self.call_stack_visible = max(1, (self.call_stack_panel.bottom - self.call_stack_rows_top - self.pad)
+                                      // self.stack_row_height)
+        
+        self._hit_grids = {
+            'input': self._build_grid({'start': self.start_button, 'editor': self.editor}),
+            'visualize': self._build_grid(dict(self.buttons, timeline=self.timeline,
+                                               call_stack=self.call_stack_panel)),
+        }
+    
+    def px(self, value: float) -> int:
+        """Scale a length from 1400x900 design pixels"""
+        return round(value * self.scale)
+    
+    def visible_rows(self, panel: pygame.Rect, rows_top: int) -> int:
+        """How many text rows fit between rows_top and the bottom of a panel"""
+        return max(0, (panel.bottom - rows_top - self.pad) // self.row_height)
+    
+    def hit(self, mode: str, pos: Tuple[int, int]) -> str:
+        """Name of the hit target under pos, or None"""
+        cell = (pos[0] // HIT_CELL_SIZE, pos[1] // HIT_CELL_SIZE)
+        for name, rect in self._hit_grids[mode].get(cell, ()):
+            if rect.collidepoint(pos):
+                return name
+        return None
+    
+    @staticmethod
+    def _build_grid(targets: Dict[str, pygame.Rect]) -> Dict[Tuple[int, int], List[Tuple[str, pygame.Rect]]]:
+        """Bucket target rects by every grid cell they overlap"""
+        grid = {}
+        for name, rect in targets.items():
+            for cell_x in range(rect.left // HIT_CELL_SIZE, (rect.right - 1) // HIT_CELL_SIZE + 1):
+                for cell_y in range(rect.top // HIT_CELL_SIZE, (rect.bottom - 1) // HIT_CELL_SIZE + 1):
+                    grid.setdefault((cell_x, cell_y), []).append((name, rect))
+        return grid
+
 
 class CodeFlowVisualizer:
     """Enhanced code visualizer with better input support"""
     
     def __init__(self):
         pygame.init()
-        self.width = 1400
-        self.height = 900
-        self.screen = pygame.display.set_mode((self.width, self.height))
+        # HiDPI factor, e.g. CODEFLOW_UI_SCALE=2 on a 4K display
+        try:
+            ui_scale = float(os.environ.get("CODEFLOW_UI_SCALE", "1.0"))
+        except ValueError:
+            ui_scale = 1.0
+        if not 0 < ui_scale < float('inf'):
+            ui_scale = 1.0
+        display = pygame.display.Info()
+        self.width = min(round(BASE_WIDTH * ui_scale), display.current_w or BASE_WIDTH)
+        self.height = min(round(BASE_HEIGHT * ui_scale), display.current_h or BASE_HEIGHT)
+        self.screen = pygame.display.set_mode((self.width, self.height), pygame.RESIZABLE)
         pygame.display.set_caption("CodeFlow - Python Code Visualizer")
         
-        # Fonts
-        self.font_small = pygame.font.Font(None, 20)
-        self.font_medium = pygame.font.Font(None, 24)
-        self.font_large = pygame.font.Font(None, 32)
-        self.font_code = pygame.font.Font(None, 18)
+        # Layout and fonts, rebuilt on resize
+        self._apply_layout(self.width, self.height)
         
         # State
         self.mode = "input"
@@ -67,12 +1449,17 @@ class CodeFlowVisualizer:
         ]
         self.cursor_pos = [2, 0]
         self.cursor_blink = 0
-        
-        # Editor area
-        self.editor_rect = pygame.Rect(20, 250, self.width - 40, 500)
+        self.history = EditHistory()
+        self._quit_requested_at = 0.0
         
         # Parsed code
         self.structured_lines = []
+        self.line_index = {}
+        
+        # Breakpoints: line number -> condition ("" for unconditional)
+        self.breakpoints: Dict[int, str] = {}
+        self.editing_condition = None
+        self.condition_input = ""
         
         # Groq API configuration
         self.groq_api_key = "YOUR_GROQ_API_KEY"
@@ -80,6 +1467,47 @@ class CodeFlowVisualizer:
         self.explanations = []
         self.current_explanation = ""
         
+        # Session files
+        self.session_path = DEFAULT_SESSION_PATH
+        self.status_message = ""
+        
+        # Recorded execution and hot-line statistics
+        self.recorder = None
+        self.line_stats = None
+        self.show_heat = False
+        self._stats_chunk = 0
+        
+        # Replay position in the recorded trace
+        self.trace_step = 0
+        self._run_to_breakpoint = False
+        
+        # Call stack at the replay position: (frame id, line, scope id), innermost first
+        self.call_stack = []
+        self.selected_frame = 0
+        
+        # Control button actions, hit-tested through the layout
+        self._button_actions = {
+            'step': self.step_execution,
+            'run': self.run_execution,
+            'pause': self.pause_execution,
+            'reset': self.reset_execution,
+            'back': self._back_to_edit,
+            'heat': self._toggle_heat,
+            'continue': self.continue_execution,
+        }
+    
+    def _apply_layout(self, width: int, height: int):
+        """Recompute geometry and fonts for a new window size"""
+        self.width = width
+        self.height = height
+        self.layout = Layout(width, height)
+        sizes = self.layout.font_sizes
+        self.font_small = pygame.font.Font(None, sizes['small'])
+        self.font_medium = pygame.font.Font(None, sizes['medium'])
+        self.font_large = pygame.font.Font(None, sizes['large'])
+        self.font_code = pygame.font.Font(None, sizes['code'])
+        self.highlighter = SyntaxHighlighter(self.font_code)
+    
     def _parse_code(self):
         """Parse code into structured format"""
         structured = []
@@ -119,29 +1547,31 @@ class CodeFlowVisualizer:
             return 'expression'
     
     def _get_char_at_pos(self, pos):
-        """Convert mouse position to cursor position"""
-        if not self.editor_rect.collidepoint(pos):
+        """Convert mouse position to cursor position using font metrics"""
+        layout = self.layout
+        if not layout.editor.collidepoint(pos):
             return None
         
         x, y = pos
-        rel_x = x - self.editor_rect.x
-        rel_y = y - self.editor_rect.y
         
         # Calculate line number
-        line_num = int(rel_y // 25)  # 25 is line height
+        line_num = max(0, (y - layout.editor_rows_top) // layout.row_height)
         if line_num >= len(self.code_input):
             line_num = len(self.code_input) - 1
         
-        # Calculate character position
-        char_pos = int((rel_x - 60) // 8)  # 60 for line numbers, 8 for char width
-        if char_pos < 0:
-            char_pos = 0
-        
+        # Calculate character position: nearest boundary by rendered width
+        rel_x = x - (layout.editor.x + layout.gutter)
         line = self.code_input[line_num]
-        if char_pos > len(line):
-            char_pos = len(line)
+        low, high = 0, len(line)
+        while low < high:
+            mid = (low + high) // 2
+            left = self.font_code.size(line[:mid])[0]
+            if left + self.font_code.size(line[mid])[0] / 2 <= rel_x:
+                low = mid + 1
+            else:
+                high = mid
         
-        return [line_num, char_pos]
+        return [line_num, low]
     
     def run(self):
         """Main game loop"""
@@ -159,6 +1589,9 @@ class CodeFlowVisualizer:
                     self._handle_key(event.key)
                 elif event.type == pygame.MOUSEBUTTONDOWN:
                     self._handle_click(event.pos)
+                elif event.type == pygame.VIDEORESIZE:
+                    self.screen = pygame.display.get_surface()
+                    self._apply_layout(event.w, event.h)
             
             self._update(dt)
             self._draw()
@@ -179,58 +1612,76 @@ class CodeFlowVisualizer:
         # Get modifier keys
         mods = pygame.key.get_mods()
         
-        # Handle Ctrl+C for exit
+        # Handle Ctrl+C for exit, confirmed by a second press
         if mods & pygame.KMOD_CTRL and key == pygame.K_c:
-            pygame.quit()
-            sys.exit()
+            if time.time() - self._quit_requested_at < 2.0:
+                pygame.quit()
+                sys.exit()
+            self._quit_requested_at = time.time()
+            self.status_message = "Press Ctrl+C again to exit"
+            return
+        
+        # Handle Ctrl+O to open a saved session
+        if mods & pygame.KMOD_CTRL and key == pygame.K_o:
+            self.open_session()
+            return
+        
+        # Handle Ctrl+Z / Ctrl+Y (or Ctrl+Shift+Z) for undo and redo, but not while typing a condition
+        if mods & pygame.KMOD_CTRL and key in (pygame.K_z, pygame.K_y) and self.editing_condition is None:
+            if key == pygame.K_y or mods & pygame.KMOD_SHIFT:
+                cursor = self.history.redo(self.code_input)
+            else:
+                cursor = self.history.undo(self.code_input)
+            if cursor:
+                self.cursor_pos = cursor
+            return
         
         # Ignore other Ctrl key combinations
         if mods & pygame.KMOD_CTRL:
             return
         
+        if self.editing_condition is not None:
+            self._handle_condition_key(key)
+            return
+        
+        row, col = self.cursor_pos
+        line = self.code_input[row]
         if key == pygame.K_RETURN:
             # Add new line
-            self.code_input.insert(self.cursor_pos[0] + 1, "")
-            self.cursor_pos[0] += 1
-            self.cursor_pos[1] = 0
+            self._replace_lines('newline', row + 1, row + 1, [""], [row + 1, 0])
         elif key == pygame.K_BACKSPACE:
-            if self.cursor_pos[1] > 0:
+            if col > 0:
                 # Delete character
-                line = self.code_input[self.cursor_pos[0]]
-                self.code_input[self.cursor_pos[0]] = line[:self.cursor_pos[1]-1] + line[self.cursor_pos[1]:]
-                self.cursor_pos[1] -= 1
-            elif self.cursor_pos[0] > 0:
+                self._replace_lines('delete', row, row + 1, [line[:col-1] + line[col:]], [row, col - 1])
+            elif row > 0:
                 # Delete line
-                if self.code_input[self.cursor_pos[0]]:
-                    self.code_input[self.cursor_pos[0]-1] += self.code_input[self.cursor_pos[0]]
-                self.code_input.pop(self.cursor_pos[0])
-                self.cursor_pos[0] -= 1
-                self.cursor_pos[1] = len(self.code_input[self.cursor_pos[0]])
+                previous = self.code_input[row - 1]
+                self._replace_lines('join', row - 1, row + 1, [previous + line], [row - 1, len(previous)])
         elif key == pygame.K_DELETE:
             # Delete character at cursor
-            line = self.code_input[self.cursor_pos[0]]
-            if self.cursor_pos[1] < len(line):
-                self.code_input[self.cursor_pos[0]] = line[:self.cursor_pos[1]] + line[self.cursor_pos[1]+1:]
+            if col < len(line):
+                self._replace_lines('delete', row, row + 1, [line[:col] + line[col+1:]], [row, col])
         elif key == pygame.K_LEFT:
+            self.history.seal()
             if self.cursor_pos[1] > 0:
                 self.cursor_pos[1] -= 1
         elif key == pygame.K_RIGHT:
-            line = self.code_input[self.cursor_pos[0]]
+            self.history.seal()
             if self.cursor_pos[1] < len(line):
                 self.cursor_pos[1] += 1
         elif key == pygame.K_UP:
+            self.history.seal()
             if self.cursor_pos[0] > 0:
                 self.cursor_pos[0] -= 1
                 self.cursor_pos[1] = min(self.cursor_pos[1], len(self.code_input[self.cursor_pos[0]]))
         elif key == pygame.K_DOWN:
+            self.history.seal()
             if self.cursor_pos[0] < len(self.code_input) - 1:
                 self.cursor_pos[0] += 1
                 self.cursor_pos[1] = min(self.cursor_pos[1], len(self.code_input[self.cursor_pos[0]]))
         elif key == pygame.K_TAB:
             # Add 4 spaces
-            line = self.code_input[self.cursor_pos[0]]
-            self.code_input[self.cursor_pos[0]] = line[:self.cursor_pos[1]] + "    " + line[self.cursor_pos[1]:]
-            self.cursor_pos[1] += 4
+            self._replace_lines('insert', row, row + 1, [line[:col] + "    " + line[col:]], [row, col + 4])
         elif key == pygame.K_F5:
             # Start visualization
             self._start_visualization()
@@ -238,9 +1689,47 @@ class CodeFlowVisualizer:
             # Handle special characters
             char = self._get_char_from_key(key)
             if char:
-                line = self.code_input[self.cursor_pos[0]]
-                self.code_input[self.cursor_pos[0]] = line[:self.cursor_pos[1]] + char + line[self.cursor_pos[1]:]
-                self.cursor_pos[1] += 1
+                self._replace_lines('insert', row, row + 1, [line[:col] + char + line[col:]], [row, col + 1])
+    
+    def _replace_lines(self, kind: str, start: int, end: int, new_lines: List[str], cursor: List[int]):
+        """Apply an edit to code_input as a line splice and record it for undo"""
+        old_lines = tuple(self.code_input[start:end])
+        self.code_input[start:end] = new_lines
+        self.history.record(kind, start, old_lines, tuple(new_lines), self.cursor_pos, cursor)
+        self.cursor_pos = cursor
+    
+    def _handle_condition_key(self, key):
+        """Handle keys while typing a breakpoint condition"""
+        if key == pygame.K_RETURN:
+            condition = self.condition_input.strip()
+            if condition:
+                try:
+                    compile(condition, "<breakpoint>", "eval")
+                except SyntaxError as e:
+                    # Keep the prompt open so the condition can be corrected
+                    self.status_message = f"Invalid condition: {e.msg}"
+                    return
+            self.breakpoints[self.editing_condition] = condition
+            self.editing_condition = None
+            self.status_message = ""
+        elif key == pygame.K_ESCAPE:
+            self.editing_condition = None
+        elif key == pygame.K_BACKSPACE:
+            self.condition_input = self.condition_input[:-1]
+        else:
+            char = self._get_char_from_key(key)
+            if char:
+                self.condition_input += char
+    
+    def _toggle_breakpoint(self, line_number: int, edit_condition: bool = False):
+        """Toggle a breakpoint, or start editing its condition"""
+        if edit_condition:
+            self.editing_condition = line_number
+            self.condition_input = self.breakpoints.get(line_number, "")
+        elif line_number in self.breakpoints:
+            del self.breakpoints[line_number]
+        else:
+            self.breakpoints[line_number] = ""
     
     def _get_char_from_key(self, key):
         """Convert key to character with special handling"""
@@ -295,17 +1784,15 @@ class CodeFlowVisualizer:
             pygame.K_BACKSLASH: '\\',
             pygame.K_HASH: '#',
             pygame.K_AT: '@',
-            pygame.K_EXCLAMATION: '!',
+            pygame.K_EXCLAIM: '!',
             pygame.K_QUESTION: '?',
             pygame.K_UNDERSCORE: '_',
             pygame.K_DOLLAR: '$',
             pygame.K_PERCENT: '%',
             pygame.K_AMPERSAND: '&',
             pygame.K_CARET: '^',
-            pygame.K_TILDE: '~',
             pygame.K_LESS: '<',
             pygame.K_GREATER: '>',
-            pygame.K_BAR: '|',
         }
         
         if key in special_chars:
@@ -317,10 +1804,20 @@ class CodeFlowVisualizer:
     
     def _handle_visualize_key(self, key):
         """Handle keys in visualize mode"""
-        if key == pygame.K_SPACE:
+        if key == pygame.K_SPACE or key == pygame.K_RIGHT:
             self.step_execution()
+        elif key == pygame.K_LEFT:
+            self.step_back()
+        elif key == pygame.K_LEFTBRACKET:
+            self._select_frame(self.selected_frame - 1)
+        elif key == pygame.K_RIGHTBRACKET:
+            self._select_frame(self.selected_frame + 1)
         elif key == pygame.K_r:
             self.run_execution()
+        elif key == pygame.K_c:
+            self.continue_execution()
+        elif key == pygame.K_s:
+            self.save_session()
         elif key == pygame.K_p:
             self.pause_execution()
         elif key == pygame.K_BACKSPACE:
@@ -329,69 +1826,151 @@ class CodeFlowVisualizer:
             self.execution_speed = max(0.1, self.execution_speed - 0.1)
         elif key == pygame.K_DOWN:
             self.execution_speed = min(2.0, self.execution_speed + 0.1)
+        elif key == pygame.K_h:
+            self._toggle_heat()
         elif key == pygame.K_F5:
-            # Back to input mode
-            self.mode = "input"
-            self._reset_visualization()
+            self._back_to_edit()
+    
+    def _back_to_edit(self):
+        """Back to input mode"""
+        self.mode = "input"
+        self._stop_recording()
+        self._reset_visualization()
+    
+    def _toggle_heat(self):
+        """Show or hide the hot-line overlay"""
+        self.show_heat = not self.show_heat
     
     def _handle_click(self, pos):
         """Handle mouse clicks"""
+        layout = self.layout
+        target = layout.hit(self.mode, pos)
         if self.mode == "input":
-            # Check for "Start Visualization" button
-            button_rect = pygame.Rect(self.width - 200, 20, 180, 40)
-            if button_rect.collidepoint(pos):
+            if target == 'start':
                 self._start_visualization()
-            else:
+            elif target == 'editor':
                 # Handle mouse cursor positioning
                 cursor_pos = self._get_char_at_pos(pos)
-                if cursor_pos:
+                if pos[0] < layout.editor.x + layout.gutter - layout.px(5):
+                    # Click in the line number gutter toggles a breakpoint
+                    shift = pygame.key.get_mods() & pygame.KMOD_SHIFT
+                    self._toggle_breakpoint(cursor_pos[0] + 1, edit_condition=bool(shift))
+                else:
+                    self.history.seal()
                     self.cursor_pos = cursor_pos
-        else:
-            # Check button clicks for visualization
-            button_rects = {
-                'step': pygame.Rect(50, self.height - 120, 100, 40),
-                'run': pygame.Rect(160, self.height - 120, 100, 40),
-                'pause': pygame.Rect(270, self.height - 120, 100, 40),
-                'reset': pygame.Rect(380, self.height - 120, 100, 40),
-                'back': pygame.Rect(490, self.height - 120, 100, 40),
-            }
-            
-            for name, rect in button_rects.items():
-                if rect.collidepoint(pos):
-                    if name == 'step':
-                        self.step_execution()
-                    elif name == 'run':
-                        self.run_execution()
-                    elif name == 'pause':
-                        self.pause_execution()
-                    elif name == 'reset':
-                        self.reset_execution()
-                    elif name == 'back':
-                        self.mode = "input"
-                        self._reset_visualization()
+        elif target == 'call_stack':
+            # Select a frame in the call stack panel
+            row = (pos[1] - layout.call_stack_rows_top) // layout.stack_row_height
+            if 0 <= row < layout.call_stack_visible:
+                self._select_frame(self._call_stack_first_row() + row)
+        elif target == 'timeline':
+            # Scrub the recorded trace on the timeline
+            if self.recorder and self.recorder.total_events:
+                fraction = (pos[0] - layout.timeline.x) / layout.timeline.width
+                self._jump_to_step(min(int(fraction * self.recorder.total_events), self.recorder.total_events - 1))
+        elif target in self._button_actions:
+            self._button_actions[target]()
     
     def _start_visualization(self):
         """Start visualization mode"""
+        self._prepare_visualization(self._parse_code())
+        
+        # Record the real execution in the background
+        self._start_recording()
+        
+        # Generate explanations for all lines
+        self._generate_explanations()
+    
+    def _prepare_visualization(self, statements: List[Dict[str, Any]]):
+        """Enter visualization mode with fresh replay state"""
         self.mode = "visualize"
-        self.structured_lines = self._parse_code()
+        self.editing_condition = None
+        self.status_message = ""
+        self.structured_lines = statements
+        self.line_index = {line['line_number']: i for i, line in enumerate(self.structured_lines)}
+        self.trace_step = 0
+        self._run_to_breakpoint = False
         self.current_line = 0
         self.variables = {}
+        self.call_stack = []
+        self.selected_frame = 0
         self.is_running = False
         self.auto_play = False
         self.explanations = []
         self.current_explanation = ""
         
-        # Generate explanations for all lines
-        self._generate_explanations()
-        
         for line in self.structured_lines:
             line['is_current'] = False
             line['is_executed'] = False
     
+    def save_session(self, path: str = None):
+        """Save the current recording so it can be replayed offline"""
+        path = path or self.session_path
+        try:
+            save_session(path, self.recorder, self.structured_lines, self.explanations)
+            self.session_path = path
+            self.status_message = f"Saved {path}"
+        except Exception as e:
+            self.status_message = f"Could not save session: {e}"
+    
+    def open_session(self, path: str = None):
+        """Replay a saved session without re-executing or calling the API"""
+        path = path or self.session_path
+        try:
+            recorder, statements, explanations = load_session(path)
+        except Exception as e:
+            self.status_message = f"Could not open session: {e}"
+            return
+        
+        self._stop_recording()
+        self._replace_lines('open', 0, len(self.code_input), recorder.source.split("\n"), [0, 0])
+        self.breakpoints = dict(recorder.breakpoints)
+        self._prepare_visualization(statements)
+        self.explanations = explanations
+        self.recorder = recorder
+        self.line_stats = LineStats(recorder.source)
+        self._stats_chunk = 0
+        self.session_path = path
+        self.status_message = f"Opened {path}"
+    
+    def _start_recording(self):
+        """Trace the program in the background for replay and statistics"""
+        self._stop_recording()
+        source = "\n".join(self.code_input)
+        self.recorder = ExecutionRecorder(source, self.breakpoints)
+        self.line_stats = LineStats(source)
+        self._stats_chunk = 0
+        self.recorder.start()
+    
+    def _stop_recording(self):
+        """Stop any recording that is still running"""
+        if self.recorder:
+            self.recorder.stop()
+    
+    def _update_line_stats(self, max_chunks: int = 8):
+        """Aggregate newly arrived trace chunks without stalling the frame"""
+        recorder = self.recorder
+        if not recorder or not self.line_stats:
+            return
+        
+        done = recorder.done
+        end = min(len(recorder.chunks), self._stats_chunk + max_chunks)
+        while self._stats_chunk < end:
+            lines, times, frame_ids, _ = recorder.chunks[self._stats_chunk]
+            self.line_stats.consume(lines, times, frame_ids)
+            self._stats_chunk += 1
+        
+        if done and self._stats_chunk == len(recorder.chunks):
+            self.line_stats.finish(recorder.end_time)
+    
     def _reset_visualization(self):
         """Reset visualization state"""
         self.current_line = 0
+        self.trace_step = 0
+        self._run_to_breakpoint = False
         self.variables = {}
+        self.call_stack = []
+        self.selected_frame = 0
         self.is_running = False
         self.auto_play = False
         
@@ -400,15 +1979,87 @@ class CodeFlowVisualizer:
             line['is_executed'] = False
     
     def step_execution(self):
-        """Execute next line"""
+        """Replay the next recorded line"""
+        self._run_to_breakpoint = False
         if not self.is_running:
             self.is_running = True
-            self.current_line = 0
+            self.trace_step = 0
         
-        if self.current_line < len(self.structured_lines):
-            self._execute_line(self.current_line)
+        if self.recorder and self.trace_step < self.recorder.total_events:
+            self._execute_step(self.trace_step)
             self.current_explanation = self._get_current_explanation()
-            self.current_line += 1
+            self.trace_step += 1
+            if self.recorder.is_breakpoint_hit(self.trace_step - 1):
+                # Stop auto-play on a breakpoint
+                self.auto_play = False
+    
+    def step_back(self):
+        """Replay the previous recorded line"""
+        if self.is_running and self.trace_step > 1:
+            self.auto_play = False
+            self._jump_to_step(self.trace_step - 2)
+    
+    def continue_execution(self):
+        """Jump to the next breakpoint hit found by the tracer"""
+        recorder = self.recorder
+        if not recorder:
+            return
+        if not self.is_running:
+            self.is_running = True
+            self.trace_step = 0
+        self.auto_play = False
+        
+        hits = recorder.breakpoint_hits
+        index = bisect.bisect_left(hits, self.trace_step)
+        if index < len(hits) and hits[index] < recorder.total_events:
+            target = hits[index]
+        elif recorder.done and index >= len(hits):
+            target = recorder.total_events - 1
+        else:
+            # Hit not recorded yet; retry from _update
+            self._run_to_breakpoint = True
+            return
+        
+        self._run_to_breakpoint = False
+        if target >= self.trace_step:
+            self._jump_to_step(target)
+    
+    def _jump_to_step(self, step: int):
+        """Move replay to any step without visiting the steps in between"""
+        # A line has run before a step exactly when its first execution is earlier
+        first_step = self.recorder.first_step
+        for line in self.structured_lines:
+            line['is_executed'] = first_step.get(line['line_number'], step) < step
+        
+        self.is_running = True
+        self._execute_step(step)
+        self.current_explanation = self._get_current_explanation()
+        self.trace_step = step + 1
+    
+    def _execute_step(self, step: int):
+        """Show the line, call stack and variables recorded at a trace step"""
+        index = self.line_index.get(self.recorder.line_at(step))
+        if index is None:
+            return
+        
+        if self.current_line < len(self.structured_lines):
+            self.structured_lines[self.current_line]['is_current'] = False
+        self.current_line = index
+        self._execute_line(index)
+        
+        self.call_stack = self.recorder.call_stack(step)
+        self._select_frame(0)
+    
+    def _select_frame(self, depth: int):
+        """Show the variables of one frame of the current call stack"""
+        if not 0 <= depth < len(self.call_stack):
+            return
+        self.selected_frame = depth
+        _, _, scope_id = self.call_stack[depth]
+        self.variables = {
+            name: {'value': value, 'type': type_name, 'line': line_number}
+            for name, value, type_name, line_number in self.recorder.scopes[scope_id]
+        }
     
     def run_execution(self):
         """Run all remaining lines"""
@@ -419,67 +2070,28 @@ class CodeFlowVisualizer:
     def pause_execution(self):
         """Pause execution"""
         self.auto_play = False
+        self._run_to_breakpoint = False
     
     def reset_execution(self):
         """Reset execution"""
         self._reset_visualization()
     
     def _execute_line(self, line_index: int):
-        """Execute a specific line"""
+        """Mark a line as the one being executed"""
         if line_index >= len(self.structured_lines):
             return
         
         line = self.structured_lines[line_index]
         line['is_current'] = True
         line['is_executed'] = True
-        
-        # Simulate execution
-        content = line['content'].strip()
-        if line['node_type'] == 'assignment':
-            self._handle_assignment(content)
-        elif line['node_type'] == 'print_statement':
-            # Simulate print
-            pass
-    
-    def _handle_assignment(self, content: str):
-        """Handle variable assignment"""
-        if '=' in content:
-            var_name = content.split('=')[0].strip()
-            value_part = content.split('=')[1].strip()
-            
-            try:
-                if '+' in value_part and not value_part.startswith('"'):
-                    # Simple arithmetic
-                    parts = value_part.split('+')
-                    if len(parts) == 2:
-                        left = parts[0].strip()
-                        right = parts[1].strip()
-                        if left.isdigit() and right.isdigit():
-                            actual_value = int(left) + int(right)
-                        else:
-                            actual_value = value_part
-                    else:
-                        actual_value = value_part
-                elif value_part.isdigit():
-                    actual_value = int(value_part)
-                elif value_part.replace('.', '').replace('-', '').isdigit():
-                    actual_value = float(value_part)
-                elif value_part.startswith('"') or value_part.startswith("'"):
-                    actual_value = value_part.strip('"\'')
-                else:
-                    actual_value = value_part
-                
-                self.variables[var_name] = {
-                    'value': actual_value,
-                    'type': type(actual_value).__name__,
-                    'line': self.structured_lines[self.current_line]['line_number']
-                }
-                
-            except:
-                pass
     
     def _update(self, dt: float):
         """Update game state"""
+        if self.mode == "visualize":
+            self._update_line_stats()
+            if self._run_to_breakpoint:
+                self.continue_execution()
+        
         if self.mode == "visualize" and self.auto_play and self.is_running:
             current_time = time.time()
             if not hasattr(self, '_last_step_time'):
@@ -497,57 +2109,71 @@ class CodeFlowVisualizer:
             self._draw_input_mode()
         else:
             self._draw_visualize_mode()
+        
+        if self.status_message:
+            message = self.font_small.render(self.status_message, True, GRAY)
+            self.screen.blit(message, (self.width - message.get_width() - self.layout.margin,
+                                       self.layout.status_message_y))
     
     def _draw_input_mode(self):
         """Draw input mode"""
+        layout = self.layout
+        
         # Draw title
         title = self.font_large.render("CodeFlow - Python Code Visualizer", True, BLACK)
-        self.screen.blit(title, (20, 20))
+        self.screen.blit(title, layout.title_pos)
         
         # Draw instructions
         instructions = [
             "Enhanced Features:",
             "- Click anywhere in the editor to position cursor",
             "- Special characters: () [] {} = + - * / # @ ! ? _ $ % & ^ ~ < > |",
-            "- Use Tab for indentation",
+            "- Use Tab for indentation; click a line number for a breakpoint (Shift+click: condition)",
             "- Press F5 or click 'Start Visualization' to begin",
-            "- Press Ctrl+C to exit"
+            "- Ctrl+Z / Ctrl+Y to undo / redo, Ctrl+O to open a saved session, Ctrl+C twice to exit"
         ]
         
-        y_offset = 80
+        y_offset = layout.instructions_top
         for instruction in instructions:
             text = self.font_medium.render(instruction, True, BLACK)
-            self.screen.blit(text, (20, y_offset))
-            y_offset += 30
+            self.screen.blit(text, (layout.margin, y_offset))
+            y_offset += layout.instruction_step
         
         # Draw code input area
-        pygame.draw.rect(self.screen, LIGHT_GRAY, self.editor_rect)
-        pygame.draw.rect(self.screen, BLACK, self.editor_rect, 2)
+        editor = layout.editor
+        pygame.draw.rect(self.screen, LIGHT_GRAY, editor)
+        pygame.draw.rect(self.screen, BLACK, editor, 2)
         
         # Draw code lines
-        y_offset = 270
-        for i, line in enumerate(self.code_input):
-            if y_offset > 720:
-                break
-            
+        self.highlighter.update(self.code_input)
+        text_x = editor.x + layout.gutter
+        y_offset = layout.editor_rows_top
+        visible = layout.visible_rows(editor, layout.editor_rows_top)
+        for i, line in enumerate(self.code_input[:visible]):
             # Line number
             line_num = self.font_code.render(f"{i+1:2d}", True, GRAY)
-            self.screen.blit(line_num, (40, y_offset))
+            self.screen.blit(line_num, (editor.x + layout.px(20), y_offset))
+            self._draw_breakpoint_marker(i + 1, editor.x, y_offset)
             
             # Line content
-            text = self.font_code.render(line, True, BLACK)
-            self.screen.blit(text, (80, y_offset))
+            self.screen.blit(self.highlighter.render_line(i), (text_x, y_offset))
             
             # Draw cursor
             if i == self.cursor_pos[0] and int(self.cursor_blink * 2) % 2:
-                cursor_surface = self.font_code.render(line[:self.cursor_pos[1]], True, BLACK)
-                cursor_x = 80 + cursor_surface.get_width()
-                pygame.draw.line(self.screen, BLACK, (cursor_x, y_offset), (cursor_x, y_offset + 20), 2)
+                cursor_x = text_x + self.font_code.size(line[:self.cursor_pos[1]])[0]
+                pygame.draw.line(self.screen, BLACK, (cursor_x, y_offset),
+                                 (cursor_x, y_offset + layout.row_height - layout.px(5)), 2)
             
-            y_offset += 25
+            y_offset += layout.row_height
+        
+        # Draw breakpoint condition prompt
+        if self.editing_condition is not None:
+            prompt = f"Break on line {self.editing_condition} if: {self.condition_input}_  (Enter: set, Esc: cancel)"
+            prompt_text = self.font_medium.render(prompt, True, RED)
+            self.screen.blit(prompt_text, (layout.margin, editor.bottom + layout.pad))
         
         # Draw "Start Visualization" button
-        button_rect = pygame.Rect(self.width - 200, 20, 180, 40)
+        button_rect = layout.start_button
         pygame.draw.rect(self.screen, GREEN, button_rect)
         pygame.draw.rect(self.screen, BLACK, button_rect, 2)
         
@@ -559,13 +2185,14 @@ class CodeFlowVisualizer:
         """Draw visualization mode"""
         # Draw title
         title = self.font_large.render("CodeFlow - Code Visualization", True, BLACK)
-        self.screen.blit(title, (20, 20))
+        self.screen.blit(title, self.layout.title_pos)
         
         # Draw code panel
         self._draw_code_panel()
         
-        # Draw variables panel
+        # Draw variables and call stack panels
         self._draw_variables_panel()
+        self._draw_call_stack_panel()
         
         # Draw explanations panel
         self._draw_explanations_panel()
@@ -575,35 +2202,41 @@ class CodeFlowVisualizer:
         
         # Draw status
         self._draw_status()
+        self._draw_timeline()
     
     def _draw_code_panel(self):
         """Draw the code display panel"""
-        panel_rect = pygame.Rect(20, 80, 700, 500)
+        layout = self.layout
+        panel_rect = layout.code_panel
         pygame.draw.rect(self.screen, LIGHT_GRAY, panel_rect)
         pygame.draw.rect(self.screen, BLACK, panel_rect, 2)
         
         # Panel title
         title = self.font_medium.render("Code Execution", True, BLACK)
-        self.screen.blit(title, (30, 90))
+        self.screen.blit(title, (panel_rect.x + layout.pad, panel_rect.y + layout.pad))
         
         # Draw code lines
-        y_offset = 130
-        for line in self.structured_lines:
-            if y_offset > 550:
-                break
+        rows_top = panel_rect.y + layout.panel_rows_top
+        y_offset = rows_top
+        for line in self.structured_lines[:layout.visible_rows(panel_rect, rows_top)]:
+            # Hot-line overlay
+            if self.show_heat:
+                self._draw_heat(line['line_number'], panel_rect, y_offset)
             
             # Line number
             line_num = self.font_code.render(f"{line['line_number']:2d}", True, GRAY)
-            self.screen.blit(line_num, (40, y_offset))
+            self.screen.blit(line_num, (panel_rect.x + layout.px(20), y_offset))
+            self._draw_breakpoint_marker(line['line_number'], panel_rect.x, y_offset)
             
             # Indent
-            indent_x = 80 + (line['indent'] * 20)
+            indent_x = panel_rect.x + layout.gutter + line['indent'] * layout.px(20)
             
             # Line content
             color = BLACK
             if line['is_current']:
                 # Highlight current line
-                highlight_rect = pygame.Rect(indent_x - 5, y_offset - 2, 650, 22)
+                highlight_rect = pygame.Rect(indent_x - layout.px(5), y_offset - layout.px(2),
+                                             panel_rect.right - indent_x, layout.row_height - layout.px(3))
                 pygame.draw.rect(self.screen, YELLOW, highlight_rect)
                 color = BLACK
             elif line['is_executed']:
@@ -611,54 +2244,139 @@ class CodeFlowVisualizer:
             
             # Node type indicator
             type_color = self._get_node_type_color(line['node_type'])
-            type_indicator = pygame.Rect(indent_x - 15, y_offset + 8, 8, 8)
+            type_indicator = pygame.Rect(indent_x - layout.px(15), y_offset + layout.px(8), layout.px(8), layout.px(8))
             pygame.draw.rect(self.screen, type_color, type_indicator)
             
             # Line text
             text = self.font_code.render(line['content'], True, color)
             self.screen.blit(text, (indent_x, y_offset))
             
-            y_offset += 25
+            y_offset += layout.row_height
+    
+    def _draw_breakpoint_marker(self, line_number: int, panel_x: int, y_offset: int):
+        """Draw a breakpoint dot in the gutter; orange when conditional"""
+        if line_number not in self.breakpoints:
+            return
+        color = ORANGE if self.breakpoints[line_number] else RED
+        layout = self.layout
+        pygame.draw.circle(self.screen, color, (panel_x + layout.pad, y_offset + layout.px(7)), layout.px(5))
+    
+    def _draw_heat(self, line_number: int, panel_rect: pygame.Rect, y_offset: int):
+        """Draw heat bar and profile numbers for one line"""
+        stats = self.line_stats
+        if not stats:
+            return
+        
+        hits = stats.hits.get(line_number, 0)
+        if not hits:
+            return
+        
+        seconds = stats.cumulative_time.get(line_number, 0.0)
+        heat = seconds / stats.max_time if stats.max_time else hits / max(stats.max_hits, 1)
+        color = tuple(int(LIGHT_GRAY[c] + (RED[c] - LIGHT_GRAY[c]) * heat * 0.6) for c in range(3))
+        layout = self.layout
+        heat_rect = pygame.Rect(panel_rect.x + 2, y_offset - layout.px(2), panel_rect.width - 4,
+                                layout.row_height - layout.px(3))
+        pygame.draw.rect(self.screen, color, heat_rect)
+        
+        label = f"{hits}x  {seconds * 1000:.1f}ms"
+        if line_number in stats.loops:
+            label += f"  {stats.loop_iterations.get(line_number, 0)} iter"
+        label_text = self.font_code.render(label, True, GRAY)
+        self.screen.blit(label_text, (panel_rect.right - label_text.get_width() - layout.pad, y_offset))
     
     def _draw_variables_panel(self):
-        """Draw the variables panel"""
-        panel_rect = pygame.Rect(740, 80, 640, 500)
+        """Draw the variables of the selected frame"""
+        layout = self.layout
+        panel_rect = layout.variables_panel
         pygame.draw.rect(self.screen, LIGHT_GRAY, panel_rect)
         pygame.draw.rect(self.screen, BLACK, panel_rect, 2)
         
         # Panel title
-        title = self.font_medium.render("Variables & State", True, BLACK)
-        self.screen.blit(title, (750, 90))
+        title_text = "Variables & State"
+        if self.call_stack:
+            title_text += f" - {self._frame_label(self.call_stack[self.selected_frame][0])}"
+        title = self.font_medium.render(title_text, True, BLACK)
+        self.screen.blit(title, (panel_rect.x + layout.pad, panel_rect.y + layout.pad))
         
         # Draw variables
-        y_offset = 130
-        for name, var in self.variables.items():
-            if y_offset > 550:
-                break
-            
+        rows_top = panel_rect.y + layout.panel_rows_top
+        y_offset = rows_top
+        for name, var in list(self.variables.items())[:layout.visible_rows(panel_rect, rows_top)]:
             # Variable name
             name_text = self.font_code.render(f"{name}:", True, BLUE)
-            self.screen.blit(name_text, (760, y_offset))
+            self.screen.blit(name_text, (panel_rect.x + layout.px(20), y_offset))
             
             # Variable value
             value_text = self.font_code.render(f"{var['value']} ({var['type']})", True, BLACK)
-            self.screen.blit(value_text, (860, y_offset))
+            self.screen.blit(value_text, (panel_rect.x + layout.px(120), y_offset))
             
             # Line created
             line_text = self.font_code.render(f"Line {var['line']}", True, GRAY)
-            self.screen.blit(line_text, (760, y_offset + 20))
+            self.screen.blit(line_text, (panel_rect.right - line_text.get_width() - layout.pad, y_offset))
             
-            y_offset += 50
+            y_offset += layout.row_height
+    
+    def _frame_label(self, frame_id: int) -> str:
+        """Display name of a recorded frame"""
+        name = self.recorder.frame_names[self.recorder.frame_name[frame_id]]
+        return name if name.startswith('<') else f"{name}()"
+    
+    def _call_stack_first_row(self) -> int:
+        """Depth shown in the first call stack row, keeping the selection in view"""
+        return max(0, self.selected_frame - self.layout.call_stack_visible + 1)
+    
+    def _draw_call_stack_panel(self):
+        """Draw the call stack at the replay position"""
+        layout = self.layout
+        panel_rect = layout.call_stack_panel
+        pygame.draw.rect(self.screen, LIGHT_GRAY, panel_rect)
+        pygame.draw.rect(self.screen, BLACK, panel_rect, 2)
+        
+        # Panel title
+        title = self.font_medium.render(f"Call Stack (depth {len(self.call_stack)})  [ / ] to select", True, BLACK)
+        self.screen.blit(title, (panel_rect.x + layout.pad, panel_rect.y + layout.px(5)))
+        
+        first = self._call_stack_first_row()
+        last = min(first + layout.call_stack_visible, len(self.call_stack))
+        for row, depth in enumerate(range(first, last)):
+            frame_id, line_number, _ = self.call_stack[depth]
+            rect = pygame.Rect(panel_rect.x + layout.pad, layout.call_stack_rows_top + row * layout.stack_row_height,
+                               panel_rect.width - 2 * layout.pad, layout.stack_row_height)
+            if depth == self.selected_frame:
+                pygame.draw.rect(self.screen, YELLOW, rect)
+            text = self.font_code.render(f"#{depth}  {self._frame_label(frame_id)}  line {line_number}", True, BLACK)
+            self.screen.blit(text, (rect.x + layout.pad, rect.y + layout.px(4)))
+    
+    def _draw_timeline(self):
+        """Draw the scrubbable trace timeline with breakpoint hits"""
+        if not self.recorder or not self.recorder.total_events:
+            return
+        
+        total = self.recorder.total_events
+        timeline_rect = self.layout.timeline
+        pygame.draw.rect(self.screen, LIGHT_GRAY, timeline_rect)
+        done_rect = pygame.Rect(timeline_rect.x, timeline_rect.y, timeline_rect.width * self.trace_step // total,
+                                timeline_rect.height)
+        pygame.draw.rect(self.screen, BLUE, done_rect)
+        
+        hits = self.recorder.breakpoint_hits
+        if len(hits) <= 1000:
+            for step in hits:
+                x = timeline_rect.x + timeline_rect.width * step // total
+                pygame.draw.line(self.screen, RED, (x, timeline_rect.y), (x, timeline_rect.bottom), 2)
+        pygame.draw.rect(self.screen, BLACK, timeline_rect, 1)
     
     def _draw_explanations_panel(self):
         """Draw the explanations panel"""
-        panel_rect = pygame.Rect(20, 600, self.width - 40, 200)
+        layout = self.layout
+        panel_rect = layout.explanations_panel
         pygame.draw.rect(self.screen, LIGHT_GRAY, panel_rect)
         pygame.draw.rect(self.screen, BLACK, panel_rect, 2)
         
         # Panel title
         title = self.font_medium.render("Step-by-Step Explanation", True, BLACK)
-        self.screen.blit(title, (30, 610))
+        self.screen.blit(title, (panel_rect.x + layout.pad, panel_rect.y + layout.pad))
         
         # Draw current explanation
         if self.current_explanation:
@@ -669,9 +2387,7 @@ class CodeFlowVisualizer:
             
             for word in words:
                 test_line = current_line + " " + word if current_line else word
-                # Use render() to get text size
-                test_surface = self.font_small.render(test_line, True, BLACK)
-                if test_surface.get_width() < self.width - 60:
+                if self.font_small.size(test_line)[0] < panel_rect.width - 2 * layout.pad:
                     current_line = test_line
                 else:
                     if current_line:
@@ -681,24 +2397,18 @@ class CodeFlowVisualizer:
             if current_line:
                 lines.append(current_line)
             
-            # Draw explanation lines
-            y_offset = 640
-            for line in lines[:4]:  # Limit to 4 lines to fit panel
+            # Draw as many explanation lines as fit the panel
+            y_offset = panel_rect.y + layout.px(40)
+            max_lines = max(1, (panel_rect.bottom - y_offset) // layout.explanation_row_height)
+            for line in lines[:max_lines]:
                 text = self.font_small.render(line, True, BLACK)
-                self.screen.blit(text, (30, y_offset))
-                y_offset += 20
+                self.screen.blit(text, (panel_rect.x + layout.pad, y_offset))
+                y_offset += layout.explanation_row_height
     
     def _draw_control_panel(self):
         """Draw the control buttons"""
-        buttons = [
-            ('Step (Space)', BLUE, pygame.Rect(50, self.height - 120, 100, 40)),
-            ('Run (R)', GREEN, pygame.Rect(160, self.height - 120, 100, 40)),
-            ('Pause (P)', ORANGE, pygame.Rect(270, self.height - 120, 100, 40)),
-            ('Reset (Backspace)', RED, pygame.Rect(380, self.height - 120, 100, 40)),
-            ('Back to Edit (F5)', PURPLE, pygame.Rect(490, self.height - 120, 100, 40)),
-        ]
-        
-        for text, color, rect in buttons:
+        for name, text, color in CONTROL_BUTTONS:
+            rect = self.layout.buttons[name]
             pygame.draw.rect(self.screen, color, rect)
             pygame.draw.rect(self.screen, BLACK, rect, 2)
             
@@ -710,24 +2420,36 @@ class CodeFlowVisualizer:
         """Draw status information"""
         # Execution state
         state = "Running" if self.is_running else "Ready"
+        layout = self.layout
         state_text = self.font_medium.render(f"State: {state}", True, BLACK)
-        self.screen.blit(state_text, (20, self.height - 80))
+        self.screen.blit(state_text, (layout.margin, layout.status_y))
         
         # Current line
         if self.structured_lines and self.current_line < len(self.structured_lines):
             current_line = self.structured_lines[self.current_line]
             line_text = self.font_medium.render(f"Line: {current_line['line_number']}", True, BLACK)
-            self.screen.blit(line_text, (200, self.height - 80))
+            self.screen.blit(line_text, (layout.px(200), layout.status_y))
         
         # Speed
         speed_text = self.font_medium.render(f"Speed: {self.execution_speed:.1f}s", True, BLACK)
-        self.screen.blit(speed_text, (400, self.height - 80))
+        self.screen.blit(speed_text, (layout.px(400), layout.status_y))
         
         # Progress
-        if self.structured_lines:
-            progress = (self.current_line / len(self.structured_lines)) * 100
+        if self.recorder and self.recorder.total_events:
+            progress = (self.trace_step / self.recorder.total_events) * 100
             progress_text = self.font_medium.render(f"Progress: {progress:.1f}%", True, BLACK)
-            self.screen.blit(progress_text, (600, self.height - 80))
+            self.screen.blit(progress_text, (layout.px(600), layout.status_y))
+        
+        # Recorded trace
+        if self.recorder:
+            if self.recorder.error:
+                trace_status = self.recorder.error
+            elif self.recorder.done:
+                trace_status = f"Trace: {self.recorder.total_events} steps"
+            else:
+                trace_status = f"Trace: recording {self.recorder.total_events} steps..."
+            trace_text = self.font_medium.render(trace_status, True, BLACK)
+            self.screen.blit(trace_text, (layout.px(800), layout.status_y))
     
     def _get_node_type_color(self, node_type: str) -> Tuple[int, int, int]:
         """Get color for node type"""
@@ -821,7 +2543,32 @@ class CodeFlowVisualizer:
 
 def main():
     """Main function"""
+    parser = argparse.ArgumentParser(description="CodeFlow - Python Code Visualizer")
+    parser.add_argument("session", nargs="?", help="session file to replay")
+    parser.add_argument("--grade", nargs="+", metavar="FILE",
+                        help="grade submissions: reference solution followed by submission files")
+    parser.add_argument("--workers", type=int, default=None, help="grading processes (default: all cores)")
+    parser.add_argument("--max-steps", type=int, default=GRADING_MAX_STEPS, help="step limit per traced program")
+    parser.add_argument("--report", metavar="FILE", help="also write grading results as JSON")
+    args = parser.parse_args()
+    
+    if args.grade:
+        if len(args.grade) < 2:
+            parser.error("--grade needs a reference solution and at least one submission")
+        started = time.time()
+        try:
+            reference, results = grade_submissions(args.grade[0], args.grade[1:], args.workers, args.max_steps)
+        except (OSError, ValueError) as e:
+            sys.exit(f"Cannot grade: {e}")
+        print(format_grading_report(reference, results, time.time() - started))
+        if args.report:
+            with open(args.report, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+        return
+    
     visualizer = CodeFlowVisualizer()
+    if args.session:
+        visualizer.open_session(args.session)
     visualizer.run()
 
 